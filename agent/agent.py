@@ -1,13 +1,20 @@
+import logging
+import uuid
 from pathlib import Path
 from typing import Optional, List, Generator
 
 import json5
 
-from web_tools.web_agent_tools import WebAgent
-from web_tools import make_web_tools, init_session, close_session
+from web_tools.web_agent_tools import WebAgent, get_agent
+from web_tools import make_web_tools, init_session, close_session, get_product_store, set_current_query, \
+    ResourceWatchdog, Speculator, ProductStore
 from config import settings
 import prompts
 from qwen_agent.agents import Assistant
+from cascade import CascadeAssistant, ModelRouter
+from llm_pool import LLMClientPool, get_llm_pool, attach_pool, run_in_session
+
+logger = logging.getLogger(__name__)
 
 # Конфиг работы LLM/VLM модели агента
 llm_cfg = {
@@ -23,21 +30,112 @@ llm_cfg = {
     }
 }
 
+# Конфиг маленькой модели каскада (по умолчанию тот же сервер, что и у основной)
+small_llm_cfg = {
+    'model_type': settings.small_model_type or settings.model_type,
+    'model': settings.small_model_name,
+    'model_server': settings.small_model_server or settings.model_server,
+    'api_key': settings.small_model_api_key or settings.api_key,
+
+    'generate_cfg': llm_cfg['generate_cfg'],
+}
+
 _agent_singleton: Optional[Assistant] = None
 _web_agent_singleton: Optional[WebAgent] = None
+_watchdog: Optional[ResourceWatchdog] = None
+_speculator: Optional[Speculator] = None
+
+def get_watchdog() -> Optional[ResourceWatchdog]:
+    """
+    Сторож ресурсов браузера, общий для всех сессий процесса.
+    """
+    global _watchdog
+    if _watchdog is None and settings.watchdog_enabled:
+        _watchdog = ResourceWatchdog(
+            max_js_heap_mb=settings.watchdog_max_js_heap_mb,
+            max_dom_nodes=settings.watchdog_max_dom_nodes,
+            max_pages=settings.watchdog_max_pages,
+            max_browser_pss_mb=settings.watchdog_max_browser_pss_mb,
+            check_interval_s=settings.watchdog_check_interval_s,
+        )
+    return _watchdog
+
+def get_store() -> ProductStore:
+    """
+    Межсессионный кэш товаров, настроенный из settings.
+    """
+    return get_product_store(
+        db_path=Path(settings.product_cache_path),
+        ttl_s=settings.product_cache_ttl_s,
+        max_entries=settings.product_cache_max_entries,
+    )
+
+def get_pool() -> LLMClientPool:
+    """
+    Общий для процесса пул клиентов LLM.
+    """
+    return get_llm_pool(
+        max_inflight=settings.llm_max_inflight,
+        max_inflight_per_session=settings.llm_max_inflight_per_session,
+        max_connections=settings.llm_max_connections,
+        max_retries=settings.llm_max_retries,
+        timeout_s=settings.llm_timeout_s,
+    )
+
+def get_speculator() -> Optional[Speculator]:
+    """
+    Спекулятивная подготовка результатов (если включена в настройках).
+    """
+    global _speculator
+    if _speculator is None and settings.speculative_enabled:
+        _speculator = Speculator(
+            ttl_s=settings.speculative_ttl_s,
+            max_task_ms=settings.speculative_max_task_ms,
+            prefetch_cards=settings.speculative_prefetch_enabled,
+        )
+    return _speculator
 
 def init_agent(show_browser: bool = False):
     """
     Инициализация агентов.
     """
-    web_agent = init_session(screenshot_path=Path("../screenshots"), headless=not show_browser)
+    store = get_store()
+    web_agent = init_session(
+        screenshot_path=Path("../screenshots"), headless=not show_browser,
+        watchdog=get_watchdog(), speculator=get_speculator(),
+        product_store=store if settings.product_extract_enabled else None,
+    )
     web_tools = make_web_tools()
 
-    agent = Assistant(
-        llm=llm_cfg,
-        function_list=web_tools,
-        system_message=prompts.SYSTEM_PROMPT,
-    )
+    if settings.small_model_name:
+        agent = CascadeAssistant(
+            llm=llm_cfg,
+            small_llm=small_llm_cfg,
+            router=ModelRouter(
+                url_fn=lambda: get_agent().get_current_url(),
+                failure_threshold=settings.cascade_failure_threshold,
+                sticky_turns=settings.cascade_sticky_turns,
+            ),
+            function_list=web_tools,
+            system_message=prompts.SYSTEM_PROMPT,
+        )
+    else:
+        agent = Assistant(
+            llm=llm_cfg,
+            function_list=web_tools,
+            system_message=prompts.SYSTEM_PROMPT,
+        )
+
+    llms = [(agent.llm, llm_cfg)]
+    if isinstance(agent, CascadeAssistant):
+        llms.append((agent.small_llm, small_llm_cfg))
+    for llm, cfg in llms:
+        if not attach_pool(llm, get_pool(), cfg['model_server'], cfg['api_key']):
+            logger.warning(
+                "Shared LLM pool is not supported for model_type=%r (%s): requests to %s bypass "
+                "the pool limits, priorities and retries",
+                cfg['model_type'], type(llm).__name__, cfg['model'],
+            )
     return agent, web_agent
 
 def get_agents(show_browser: bool = False):
@@ -51,14 +149,35 @@ def get_agents(show_browser: bool = False):
 
     return _agent_singleton, _web_agent_singleton
 
-def run_agent(query: str, messages: List = None) -> Generator[str, None, None]:
+def get_metrics() -> dict:
+    """
+    Метрики работы агента.
+    """
+    watchdog = get_watchdog()
+    speculator = get_speculator()
+    return {
+        "llm_pool": get_pool().metrics(),
+        "models": _agent_singleton.metrics() if isinstance(_agent_singleton, CascadeAssistant) else None,
+        "product_cache": get_store().metrics(),
+        "browser": watchdog.metrics() if watchdog else None,
+        "speculation": speculator.metrics() if speculator else None,
+    }
+
+def run_agent(query: str, messages: List = None, session_id: Optional[str] = None) -> Generator[str, None, None]:
     """
     Запуск агента с заданной историей сообщений и входным запросом.
+    session_id используется пулом клиентов LLM для лимитов и приоритетов сессии.
     """
     agent, web_agent = get_agents(show_browser=False)
 
     if not messages:
         messages = []
+    if not session_id:
+        session_id = uuid.uuid4().hex
+
+    set_current_query(query)
+    if isinstance(agent, CascadeAssistant):
+        agent.router.reset(session_id)
 
     start_screen = web_agent.screenshot()
     messages += [
@@ -68,25 +187,48 @@ def run_agent(query: str, messages: List = None) -> Generator[str, None, None]:
         ]}
     ]
 
-    for ret_messages_list in agent.run(messages):
-        if ret_messages_list:
-            last_message = ret_messages_list[-1]
-            content = last_message.get('content', '') if isinstance(last_message, dict) else last_message.content
-
-            if isinstance(content, str):
-                chunk_data = {"type": "text", "content": content}
-                yield json5.dumps(chunk_data) + "\n"
-            elif isinstance(content, list):
-                for item in content:
-                    if 'text' in item and item['text']:
-                        chunk_data = {"type": "text", "content": item['text']}
-                        yield json5.dumps(chunk_data) + "\n"
-                    elif 'image' in item and item['image']:
-                        chunk_data = {"type": "image", "content": item['image']}
-                        yield json5.dumps(chunk_data) + "\n"
-                    elif 'image_url' in item and item['image_url'].get('url'):
-                        chunk_data = {"type": "image", "content": item['image_url']['url']}
-                        yield json5.dumps(chunk_data) + "\n"
-
-    close_session()
+    try:
+        for ret_messages_list in run_in_session(agent.run(messages), session_id):
+            if web_agent.speculator is not None:
+                web_agent.speculator.on_chunk()
+
+            if ret_messages_list:
+                last_message = ret_messages_list[-1]
+                content = last_message.get('content', '') if isinstance(last_message, dict) else last_message.content
+
+                if isinstance(content, str):
+                    chunk_data = {"type": "text", "content": content}
+                    yield json5.dumps(chunk_data) + "\n"
+                elif isinstance(content, list):
+                    for item in content:
+                        if 'text' in item and item['text']:
+                            chunk_data = {"type": "text", "content": item['text']}
+                            yield json5.dumps(chunk_data) + "\n"
+                        elif 'image' in item and item['image']:
+                            chunk_data = {"type": "image", "content": item['image']}
+                            yield json5.dumps(chunk_data) + "\n"
+                        elif 'image_url' in item and item['image_url'].get('url'):
+                            chunk_data = {"type": "image", "content": item['image_url']['url']}
+                            yield json5.dumps(chunk_data) + "\n"
+
+            # Пока модель стримит рассуждения, браузер простаивает — подготавливаем вероятные результаты
+            # (уже после отправки чанка клиенту).
+            # На чанках с вызовом инструмента и результатах инструментов не работаем: дальше сразу идёт
+            # выполнение инструмента или запрос к модели, и шаг бы их задержал.
+            if web_agent.speculator is not None:
+                last = ret_messages_list[-1] if ret_messages_list else None
+                can_work = (
+                    last is not None
+                    and (last.get('role') if isinstance(last, dict) else last.role) == 'assistant'
+                    and not (last.get('function_call') if isinstance(last, dict) else last.function_call)
+                )
+                if can_work:
+                    web_agent.speculator.on_idle(web_agent)
+    finally:
+        # Выполняется и при ошибке, и при отключении клиента (GeneratorExit)
+        get_pool().end_session(session_id)
+        if isinstance(agent, CascadeAssistant):
+            agent.router.reset(session_id)
+        close_session()
+
     yield json5.dumps({"type": "status", "content": "session_closed"}) + "\n"
\ No newline at end of file
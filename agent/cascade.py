@@ -0,0 +1,254 @@
+"""
+Каскад моделей: простые шаги — маленькой модели, важные — большой
+
+Возможности:
+- Маршрутизирует каждый ход агента на уровень 'small' или 'large'
+- Навигацию и служебные шаги (закрыть рекламу, ввести запрос, прокрутить) отдаёт маленькой модели
+- Чтение отзывов, карточки товаров и финальный выбор отдаёт большой модели
+- Эскалирует ход на большую модель при низкой уверенности или ошибке маленькой и после повторных неудач
+- Считает неудачи отдельно для каждой сессии (сессия — из llm_pool.run_in_session)
+- Считает задержку, изображения и приблизительные текстовые токены по уровням
+"""
+import threading
+import time
+from typing import Optional, Callable, Iterator, List, Any
+
+import json5
+from qwen_agent.agents import Assistant
+from qwen_agent.llm import get_chat_model
+from qwen_agent.utils.tokenization_qwen import count_tokens
+from qwen_agent.utils.utils import merge_generate_cfgs
+
+from llm_pool import current_session
+
+SMALL = "small"
+LARGE = "large"
+
+# Инструменты, после которых следующий ход — навигация
+_NAVIGATION_TOOLS = {"click", "type_text", "scroll", "wait", "go_back", "batch_actions", "save_product"}
+# Инструменты, после которых модель выбирает товар или изучает детали
+_DECISION_TOOLS = {"get_current_url", "lookup_cached_products", "zoom"}
+# Страницы, где читаются карточки и отзывы
+_LARGE_URL_MARKERS = ("/detail.aspx", "/feedbacks")
+_LOW_CONFIDENCE_MARKERS = ("не уверен", "не могу", "непонятно", "not sure", "unclear", "i can't", "i cannot")
+
+
+def _get(message: Any, key: str, default: Any = None) -> Any:
+    if isinstance(message, dict):
+        return message.get(key, default)
+    return getattr(message, key, default)
+
+
+def _images(content: Any) -> int:
+    """Число изображений в сообщении."""
+    if isinstance(content, list):
+        return sum(1 for item in content if _get(item, "image") or _get(item, "image_url"))
+    return 0
+
+
+def _text(content: Any) -> str:
+    """Текст сообщения без изображений."""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(_get(item, "text") or "" for item in content)
+    return ""
+
+
+class ModelRouter:
+    """Выбор уровня модели для очередного хода.
+
+    Параметры конструктора:
+      - url_fn: функция, возвращающая текущий URL браузера (None — не учитывать страницу)
+      - failure_threshold: после стольких неудач подряд ходы идут на большую модель
+      - sticky_turns: сколько ходов оставаться на большой модели после эскалации по неудачам
+
+    Счётчики неудач хранятся по сессиям (llm_pool.current_session), так что параллельные сессии
+    общего Assistant не сбрасывают и не смешивают состояние друг друга.
+    """
+
+    def __init__(
+        self,
+        url_fn: Optional[Callable[[], str]] = None,
+        failure_threshold: int = 2,
+        sticky_turns: int = 3,
+    ) -> None:
+        self.url_fn = url_fn
+        self.failure_threshold = failure_threshold
+        self.sticky_turns = sticky_turns
+        self._lock = threading.Lock()
+        # сессия -> [неудач подряд, сколько ходов ещё оставаться на большой модели]
+        self._state: dict[str, list[int]] = {}
+
+    def route(self, messages: List[Any]) -> str:
+        """Возвращает SMALL или LARGE для следующего хода по истории сообщений."""
+        with self._lock:
+            state = self._state.get(current_session())
+            if state is not None and state[1] > 0:
+                state[1] -= 1
+                return LARGE
+
+        last = messages[-1] if messages else None
+        if last is None or _get(last, "role") != "function":
+            # Первый ход по запросу: закрыть рекламу, найти поле поиска
+            return SMALL
+
+        if _get(last, "name") in _DECISION_TOOLS:
+            return LARGE
+
+        if self.url_fn is not None:
+            try:
+                url = self.url_fn() or ""
+            except Exception:
+                url = ""
+            if any(marker in url for marker in _LARGE_URL_MARKERS):
+                return LARGE
+
+        if _get(last, "name") in _NAVIGATION_TOOLS:
+            return SMALL
+        return LARGE
+
+    def accepts(self, output: List[Any], function_names: set[str]) -> bool:
+        """Проверяет ответ маленькой модели. False — низкая уверенность, ход нужно эскалировать."""
+        if not output:
+            return False
+        last = output[-1]
+        function_call = _get(last, "function_call")
+        if not function_call:
+            # Финальный ответ (выбор товара) всегда даёт большая модель
+            return False
+
+        name = _get(function_call, "name")
+        if name not in function_names:
+            return False
+        try:
+            args = _get(function_call, "arguments") or "{}"
+            json5.loads(args)
+        except ValueError:
+            return False
+
+        text = _text(_get(last, "content")).lower()
+        return not any(marker in text for marker in _LOW_CONFIDENCE_MARKERS)
+
+    def record_result(self, messages: List[Any]) -> None:
+        """Учитывает результат инструмента: ошибки и повторы одного и того же вызова считаются неудачами."""
+        failed = False
+        if messages and _get(messages[-1], "role") == "function":
+            failed = "error" in _text(_get(messages[-1], "content")).lower()
+
+        calls = [
+            (_get(_get(m, "function_call"), "name"), _get(_get(m, "function_call"), "arguments"))
+            for m in messages if _get(m, "function_call")
+        ]
+        if len(calls) >= 3 and calls[-1] == calls[-2] == calls[-3]:
+            failed = True
+
+        with self._lock:
+            state = self._state.setdefault(current_session(), [0, 0])
+            state[0] = state[0] + 1 if failed else 0
+            if state[0] >= self.failure_threshold:
+                state[1] = self.sticky_turns
+                state[0] = 0
+
+    def reset(self, session: str) -> None:
+        """Забыть неудачи сессии (новый запрос или завершение сессии)."""
+        with self._lock:
+            self._state.pop(session, None)
+
+
+class CascadeAssistant(Assistant):
+    """Assistant, вызывающий маленькую или большую модель в зависимости от шага.
+
+    Ответ маленькой модели буферизуется целиком и отдаётся только если router.accepts его принял,
+    иначе тот же ход повторяется на большой модели.
+    """
+
+    def __init__(self, *args, small_llm: dict, router: ModelRouter, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.small_llm = get_chat_model(small_llm)
+        self.router = router
+        self._lock = threading.Lock()
+        self._metrics = {
+            tier: {"calls": 0, "errors": 0, "latency_ms": 0.0, "input_images": 0,
+                   "approx_text_input_tokens": 0, "approx_text_output_tokens": 0}
+            for tier in (SMALL, LARGE)
+        }
+        self._metrics["escalations"] = 0
+
+    def _call_llm(
+        self,
+        messages: List[Any],
+        functions: Optional[List[dict]] = None,
+        stream: bool = True,
+        extra_generate_cfg: Optional[dict] = None,
+    ) -> Iterator[List[Any]]:
+        self.router.record_result(messages)
+        tier = self.router.route(messages)
+        kwargs = dict(functions=functions, stream=stream, extra_generate_cfg=extra_generate_cfg)
+
+        if tier == SMALL:
+            output = []
+            try:
+                for output in self._call_tier(SMALL, messages, **kwargs):
+                    pass
+            except Exception:
+                # Маленькая модель недоступна или вернула ошибку — ход выполняет большая
+                output = []
+                with self._lock:
+                    self._metrics[SMALL]["errors"] += 1
+            if self.router.accepts(output, set(self.function_map)):
+                yield output
+                return
+            with self._lock:
+                self._metrics["escalations"] += 1
+
+        yield from self._call_tier(LARGE, messages, **kwargs)
+
+    def _call_tier(
+        self,
+        tier: str,
+        messages: List[Any],
+        functions: Optional[List[dict]],
+        stream: bool,
+        extra_generate_cfg: Optional[dict],
+    ) -> Iterator[List[Any]]:
+        # Модель выбирается локально: self.llm общий для всех сессий и не подменяется
+        llm = self.small_llm if tier == SMALL else self.llm
+        start = time.perf_counter()
+        responses = llm.chat(
+            messages=messages,
+            functions=functions,
+            stream=stream,
+            extra_generate_cfg=merge_generate_cfgs(
+                base_generate_cfg=getattr(self, "extra_generate_cfg", None),
+                new_generate_cfg=extra_generate_cfg,
+            ),
+        )
+
+        output = []
+        for output in responses if stream else [responses]:
+            yield output
+        self._record(tier, messages, output, (time.perf_counter() - start) * 1000)
+
+    def _record(self, tier: str, messages: List[Any], output: List[Any], latency_ms: float) -> None:
+        # Токены считаются приблизительно и только по тексту; изображения (скриншоты) считаются отдельно, штуками
+        input_images = sum(_images(_get(m, "content")) for m in messages)
+        input_tokens = sum(count_tokens(_text(_get(m, "content"))) for m in messages)
+        output_tokens = sum(count_tokens(_text(_get(m, "content"))) for m in output or [])
+        with self._lock:
+            stats = self._metrics[tier]
+            stats["calls"] += 1
+            stats["latency_ms"] += latency_ms
+            stats["input_images"] += input_images
+            stats["approx_text_input_tokens"] += input_tokens
+            stats["approx_text_output_tokens"] += output_tokens
+
+    def metrics(self) -> dict[str, Any]:
+        """Вызовы, ошибки, суммарная и средняя задержка, изображения и текстовые токены по уровням, число эскалаций."""
+        with self._lock:
+            result: dict[str, Any] = {"escalations": self._metrics["escalations"]}
+            for tier in (SMALL, LARGE):
+                stats = dict(self._metrics[tier])
+                stats["avg_latency_ms"] = stats["latency_ms"] / stats["calls"] if stats["calls"] else 0.0
+                result[tier] = stats
+            return result
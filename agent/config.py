@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class AgentSettings(BaseSettings):
@@ -6,6 +8,44 @@ class AgentSettings(BaseSettings):
     model_name: str
     api_key: str
 
+    # Каскад моделей: маленькая модель для навигации (пустое имя — каскад выключен)
+    small_model_name: Optional[str] = None
+    small_model_type: Optional[str] = None
+    small_model_server: Optional[str] = None
+    small_model_api_key: Optional[str] = None
+    cascade_failure_threshold: int = 2
+    cascade_sticky_turns: int = 3
+
+    # Общий пул клиентов LLM
+    llm_max_inflight: int = 8
+    llm_max_inflight_per_session: int = 2
+    llm_max_connections: int = 16
+    llm_max_retries: int = 4
+    llm_timeout_s: float = 120.0
+
+    # Межсессионный кэш товаров
+    product_cache_path: str = "../product_cache.sqlite3"
+    product_cache_ttl_s: int = 24 * 3600
+    product_cache_max_entries: int = 5000
+    # Писать товары со страницы (цена, рейтинг, ссылка) в кэш после каждого скриншота
+    product_extract_enabled: bool = True
+
+    # Сторож ресурсов браузера (пустое значение порога — не проверять)
+    watchdog_enabled: bool = True
+    watchdog_max_js_heap_mb: Optional[float] = 512
+    watchdog_max_dom_nodes: Optional[int] = 200_000
+    watchdog_max_pages: Optional[int] = 5
+    # Перезапуск всего браузера теряет состояние страницы, поэтому по умолчанию выключен
+    watchdog_max_browser_pss_mb: Optional[float] = None
+    watchdog_check_interval_s: float = 10.0
+
+    # Спекулятивная подготовка результатов, пока модель генерирует ответ (opt-in)
+    speculative_enabled: bool = False
+    speculative_ttl_s: float = 30.0
+    speculative_max_task_ms: int = 300
+    # Открывать карточку товара под указателем в одноразовом контексте (без cookies агента)
+    speculative_prefetch_enabled: bool = False
+
     model_config = SettingsConfigDict(
         env_file="agent/.env",
         env_file_encoding="utf-8",
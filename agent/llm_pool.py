@@ -0,0 +1,312 @@
+"""
+Общий пул клиентов LLM на процесс
+
+Возможности:
+- Один OpenAI-совместимый клиент с keep-alive пулом соединений на каждый (model_server, api_key)
+- Глобальный и посессионный лимит одновременных запросов к серверу инференса
+- Приоритет сессиям, которые ближе к завершению (сделали больше ходов), со старением ожидающих запросов,
+  чтобы новые сессии не ждали бесконечно
+- Повторы с экспоненциальной задержкой и джиттером на 429/5xx и ошибки соединения
+- Метрики задержки, ожидания в очереди и глубины очереди
+"""
+import contextvars
+import copy
+import itertools
+import random
+import threading
+import time
+from collections import deque
+from typing import Optional, Any, Iterator, Iterable, TypeVar
+
+import httpx
+import openai
+
+T = TypeVar("T")
+
+# Параметры, которые OpenAI API v1 принимает только через extra_body
+_EXTRA_BODY_PARAMS = ("top_k", "repetition_penalty")
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+_session: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("llm_session", default=None)
+
+
+class _Scheduler:
+    """Семафор с приоритетами: глобальный лимит, лимит на сессию, очередь по (приоритет + старение, порядок прихода).
+
+    Старение: за каждый запрос, обслуженный раньше ожидающего, его приоритет растёт на aging_per_grant.
+    Поэтому запрос с низким приоритетом обслуживается не позже, чем через
+    (разница приоритетов / aging_per_grant) чужих запросов.
+    """
+
+    def __init__(self, max_inflight: int, max_inflight_per_session: int, aging_per_grant: float = 1.0) -> None:
+        self.max_inflight = max_inflight
+        self.max_inflight_per_session = max_inflight_per_session
+        self.aging_per_grant = aging_per_grant
+        self._cond = threading.Condition()
+        # (приоритет, номер выдачи на момент постановки в очередь, порядок прихода, сессия)
+        self._waiters: list[tuple[int, int, int, str]] = []
+        self._seq = itertools.count()
+        self._grants = 0
+        self._inflight = 0
+        self._session_inflight: dict[str, int] = {}
+        self.max_queue_depth = 0
+
+    def acquire(self, session: str, priority: int) -> None:
+        with self._cond:
+            entry = (priority, self._grants, next(self._seq), session)
+            self._waiters.append(entry)
+            self.max_queue_depth = max(self.max_queue_depth, len(self._waiters))
+            while self._next_eligible() != entry:
+                self._cond.wait()
+            self._waiters.remove(entry)
+            self._grants += 1
+            self._inflight += 1
+            self._session_inflight[session] = self._session_inflight.get(session, 0) + 1
+            self._cond.notify_all()
+
+    def release(self, session: str) -> None:
+        with self._cond:
+            self._inflight -= 1
+            left = self._session_inflight.get(session, 1) - 1
+            if left > 0:
+                self._session_inflight[session] = left
+            else:
+                self._session_inflight.pop(session, None)
+            self._cond.notify_all()
+
+    def snapshot(self) -> dict[str, int]:
+        with self._cond:
+            return {
+                "inflight": self._inflight,
+                "queue_depth": len(self._waiters),
+                "max_queue_depth": self.max_queue_depth,
+                "active_sessions": len(self._session_inflight),
+            }
+
+    def _next_eligible(self) -> Optional[tuple[int, int, int, str]]:
+        """Первый в очереди запрос, чья сессия не исчерпала свой лимит. Вызывать под _cond."""
+        if self._inflight >= self.max_inflight:
+            return None
+        for entry in sorted(self._waiters, key=self._rank):
+            if self._session_inflight.get(entry[3], 0) < self.max_inflight_per_session:
+                return entry
+        return None
+
+    def _rank(self, entry: tuple[int, int, int, str]) -> tuple[float, int]:
+        priority, grants_at_enqueue, seq, _ = entry
+        return -(priority + (self._grants - grants_at_enqueue) * self.aging_per_grant), seq
+
+
+class LLMClientPool:
+    """Общий для процесса слой доступа к OpenAI-совместимому серверу инференса.
+
+    Параметры конструктора:
+      - max_inflight: максимум одновременных запросов на процесс
+      - max_inflight_per_session: максимум одновременных запросов одной сессии
+      - max_connections: размер пула HTTP-соединений на сервер
+      - max_retries: число повторов на 429/5xx/ошибки соединения
+      - backoff_base_s / backoff_max_s: базовая и максимальная задержка между повторами
+      - timeout_s: таймаут запроса
+    """
+
+    def __init__(
+        self,
+        max_inflight: int = 8,
+        max_inflight_per_session: int = 2,
+        max_connections: int = 16,
+        max_retries: int = 4,
+        backoff_base_s: float = 0.5,
+        backoff_max_s: float = 10.0,
+        timeout_s: float = 120.0,
+    ) -> None:
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.timeout_s = timeout_s
+        self._scheduler = _Scheduler(max_inflight, max_inflight_per_session)
+        self._clients: dict[tuple[str, str], openai.OpenAI] = {}
+        self._session_calls: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._latencies_ms: deque[float] = deque(maxlen=1000)
+        self._queue_waits_ms: deque[float] = deque(maxlen=1000)
+        self._metrics = {"requests": 0, "retries": 0, "errors": 0}
+
+    # --------------------------- Публичные операции ---------------------------
+    def client(self, base_url: str, api_key: str) -> openai.OpenAI:
+        """Общий клиент с keep-alive пулом соединений для сервера."""
+        key = (base_url, api_key)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = openai.OpenAI(
+                    base_url=base_url or None,
+                    api_key=api_key or "EMPTY",
+                    max_retries=0,  # повторы делаем сами, освобождая слот на время задержки
+                    http_client=httpx.Client(
+                        limits=httpx.Limits(
+                            max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_connections,
+                        ),
+                        timeout=self.timeout_s,
+                    ),
+                )
+            return self._clients[key]
+
+    def chat_completion(self, base_url: str, api_key: str, **kwargs) -> Any:
+        """chat.completions.create через общий клиент, с лимитами, приоритетом и повторами.
+
+        Для stream=True слот удерживается, пока поток ответа не будет дочитан.
+        """
+        kwargs = _move_extra_params(kwargs)
+        client = self.client(base_url, api_key)
+        session = current_session()
+        priority = self._priority(session)
+
+        attempt = 0
+        while True:
+            queued_at = time.perf_counter()
+            self._scheduler.acquire(session, priority)
+            started_at = time.perf_counter()
+            self._queue_waits_ms.append((started_at - queued_at) * 1000)
+            try:
+                response = client.chat.completions.create(**kwargs)
+            except Exception as e:
+                self._scheduler.release(session)
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    with self._lock:
+                        self._metrics["errors"] += 1
+                    raise
+                attempt += 1
+                with self._lock:
+                    self._metrics["retries"] += 1
+                time.sleep(delay)
+                continue
+
+            with self._lock:
+                self._metrics["requests"] += 1
+                self._session_calls[session] = self._session_calls.get(session, 0) + 1
+            if kwargs.get("stream"):
+                return self._release_after(response, session, started_at)
+            self._finish(session, started_at)
+            return response
+
+    def end_session(self, session: str) -> None:
+        """Забыть счётчик ходов завершённой сессии."""
+        with self._lock:
+            self._session_calls.pop(session, None)
+
+    def metrics(self) -> dict[str, Any]:
+        """Запросы, повторы, ошибки, задержка, ожидание в очереди и глубина очереди."""
+        with self._lock:
+            latencies = sorted(self._latencies_ms)
+            waits = sorted(self._queue_waits_ms)
+            return {
+                **self._metrics,
+                **self._scheduler.snapshot(),
+                "latency_ms_p50": _percentile(latencies, 0.5),
+                "latency_ms_p95": _percentile(latencies, 0.95),
+                "queue_wait_ms_p50": _percentile(waits, 0.5),
+                "queue_wait_ms_p95": _percentile(waits, 0.95),
+            }
+
+    def _release_after(self, stream: Iterable[T], session: str, started_at: float) -> Iterator[T]:
+        try:
+            yield from stream
+        finally:
+            self._finish(session, started_at)
+
+    def _finish(self, session: str, started_at: float) -> None:
+        self._scheduler.release(session)
+        self._latencies_ms.append((time.perf_counter() - started_at) * 1000)
+
+    def _priority(self, session: str) -> int:
+        """Сессии, сделавшие больше ходов, ближе к завершению — обслуживаются раньше."""
+        with self._lock:
+            return min(self._session_calls.get(session, 0), 50)
+
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """Задержка перед повтором или None, если ошибка не временная или повторы исчерпаны."""
+        if attempt >= self.max_retries:
+            return None
+        if isinstance(error, openai.APIStatusError):
+            if error.status_code not in _RETRY_STATUS:
+                return None
+            retry_after = error.response.headers.get("retry-after") if error.response is not None else None
+            if retry_after:
+                try:
+                    return min(float(retry_after), self.backoff_max_s)
+                except ValueError:
+                    pass
+        elif not isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+            return None
+        delay = min(self.backoff_base_s * 2 ** attempt, self.backoff_max_s)
+        return delay * random.uniform(0.5, 1.5)
+
+
+def _move_extra_params(kwargs: dict[str, Any]) -> dict[str, Any]:
+    """Переносит параметры, не поддерживаемые OpenAI API v1, в extra_body (как это делает qwen_agent)."""
+    kwargs = dict(kwargs)
+    if any(k in kwargs for k in _EXTRA_BODY_PARAMS):
+        kwargs["extra_body"] = copy.deepcopy(kwargs.get("extra_body") or {})
+        for k in _EXTRA_BODY_PARAMS:
+            if k in kwargs:
+                kwargs["extra_body"][k] = kwargs.pop(k)
+    if "request_timeout" in kwargs:
+        kwargs["timeout"] = kwargs.pop("request_timeout")
+    return kwargs
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def current_session() -> str:
+    """Сессия, которой помечены вызовы LLM в текущем контексте ("default", если не задана)."""
+    return _session.get() or "default"
+
+
+def run_in_session(iterator: Iterator[T], session: str) -> Iterator[T]:
+    """Итерирует iterator, помечая все вызовы LLM внутри него сессией session.
+
+    Контекст выставляется на каждый шаг отдельно: StreamingResponse возобновляет генератор
+    в разных потоках пула, и contextvar, выставленный на предыдущем шаге, туда не переносится.
+    """
+    while True:
+        token = _session.set(session)
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _session.reset(token)
+        yield item
+
+
+def attach_pool(llm: Any, pool: LLMClientPool, base_url: str, api_key: str) -> bool:
+    """Переключает модель qwen_agent (OpenAI-совместимую) на общий пул.
+
+    False, если модель не поддерживается (нет _chat_complete_create) — вызывающий должен сообщить об этом.
+    """
+    if not hasattr(llm, "_chat_complete_create"):
+        return False
+
+    def _chat_complete_create(*args, **kwargs):
+        return pool.chat_completion(base_url, api_key, **kwargs)
+
+    llm._chat_complete_create = _chat_complete_create
+    return True
+
+
+# --------------------------- Модульный синглтон ---------------------------
+_pool_singleton: Optional[LLMClientPool] = None
+
+
+def get_llm_pool(**kwargs) -> LLMClientPool:
+    """Возвращает единый пул клиентов LLM (создаётся при первом вызове с переданными параметрами)."""
+    global _pool_singleton
+    if _pool_singleton is None:
+        _pool_singleton = LLMClientPool(**kwargs)
+    return _pool_singleton
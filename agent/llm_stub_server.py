@@ -0,0 +1,157 @@
+"""
+Локальный OpenAI-совместимый stub-сервер для проверки пула клиентов LLM
+
+Отвечает на POST /v1/chat/completions (обычный и потоковый режим) с заданной задержкой
+и долей ошибок 429/503, считает одновременные запросы и соединения.
+
+Запуск:
+    python llm_stub_server.py --port 8099 --latency-ms 500 --fail-rate 0.2
+
+После этого в .env: MODEL_SERVER=http://127.0.0.1:8099/v1, MODEL_TYPE=oai
+Статистика сервера: GET /stats
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubState:
+    def __init__(self, latency_ms: int, fail_rate: float, reply: str) -> None:
+        self.latency_ms = latency_ms
+        self.fail_rate = fail_rate
+        self.reply = reply
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.max_inflight = 0
+        self.requests = 0
+        self.failures = 0
+        self.connections = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "failures": self.failures,
+                "inflight": self.inflight,
+                "max_inflight": self.max_inflight,
+                "connections": self.connections,
+            }
+
+
+def make_handler(state: StubState) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        # keep-alive: по числу connections видно, переиспользует ли клиент соединения
+        protocol_version = "HTTP/1.1"
+
+        def setup(self) -> None:
+            super().setup()
+            with state.lock:
+                state.connections += 1
+
+        def log_message(self, format, *args) -> None:
+            pass
+
+        def do_GET(self) -> None:
+            if self.path.rstrip("/") == "/stats":
+                self._send_json(200, state.stats())
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self) -> None:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+
+            with state.lock:
+                state.requests += 1
+                state.inflight += 1
+                state.max_inflight = max(state.max_inflight, state.inflight)
+            try:
+                time.sleep(state.latency_ms / 1000)
+                if random.random() < state.fail_rate:
+                    with state.lock:
+                        state.failures += 1
+                    status = random.choice([429, 503])
+                    self._send_json(status, {"error": {"message": "stub failure", "code": status}},
+                                    headers={"Retry-After": "0.1"} if status == 429 else None)
+                    return
+                if body.get("stream"):
+                    self._send_stream(body.get("model", "stub"))
+                else:
+                    self._send_json(200, self._completion(body.get("model", "stub")))
+            finally:
+                with state.lock:
+                    state.inflight -= 1
+
+        def _completion(self, model: str) -> dict:
+            return {
+                "id": f"stub-{time.time_ns()}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": state.reply},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            }
+
+        def _send_stream(self, model: str) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for word in state.reply.split(" "):
+                chunk = {
+                    "id": "stub",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+                }
+                self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _write_chunk(self, text: str) -> None:
+            data = text.encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def _send_json(self, status: int, payload: dict, headers: dict | None = None) -> None:
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8099, latency_ms: int = 500, fail_rate: float = 0.0,
+          reply: str = "Готово.") -> ThreadingHTTPServer:
+    """Создаёт сервер (запускать через serve_forever(), например в отдельном потоке)."""
+    server = ThreadingHTTPServer((host, port), make_handler(StubState(latency_ms, fail_rate, reply)))
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=int, default=500)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--reply", default="Готово.")
+    args = parser.parse_args()
+
+    print(f"Stub LLM server on http://{args.host}:{args.port}/v1")
+    serve(args.host, args.port, args.latency_ms, args.fail_rate, args.reply).serve_forever()
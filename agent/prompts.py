@@ -6,6 +6,7 @@ SYSTEM:
 QUERY_PROMPT = """ 
 SYSTEM:
 Запрос пользователя: '{query}'.
+Сначала проверь кэш товаров из прошлых сессий (lookup_cached_products), если там есть подходящие кандидаты — проверь их по ссылке.
 Закрой рекламу если есть
 Потом оцени релевантность товаров. Если надо, зайди в карточку кандидата и посмотри ее отзывы. После этого выбери один и верни ссылку (для этого у тебя есть инструмент). Если ничего нет, то так и скажи.
 """
\ No newline at end of file
@@ -1,7 +1,7 @@
 from fastapi import FastAPI
 from starlette.responses import StreamingResponse
 
-from agent import run_agent, init_agent
+from agent import run_agent, init_agent, get_metrics
 
 app = FastAPI()
 
@@ -14,9 +14,14 @@ def startup():
 def agent_query(payload: dict):
     query = payload.get("query")
     messages = payload.get("messages")
-    result_generator = run_agent(query=query, messages=messages)
+    session_id = payload.get("session_id")
+    result_generator = run_agent(query=query, messages=messages, session_id=session_id)
     return StreamingResponse(result_generator, media_type="application/x-jsonl")
 
+@app.get("/agent/metrics")
+def metrics():
+    return get_metrics()
+
 @app.get("/agent/health")
 def health():
     return {"status": "ok"}
@@ -4,6 +4,10 @@ import json5
 from qwen_agent.llm.schema import ContentItem
 
 from .web_agent_tools import WebAgent, get_agent, close_agent
+from .resource_watchdog import ResourceWatchdog
+from .speculation import Speculator
+from .product_store import ProductStore, get_product_store, close_product_store, set_current_query, \
+    get_current_query, product_id_from_url
 from qwen_agent.tools.base import BaseTool, register_tool
 
 def init_session(
@@ -13,11 +17,15 @@ def init_session(
         viewport: Optional[tuple[int, int]] = (1000, 1000),
         user_agent: Optional[str] = None,
         screenshot_path: Path = Path("web-tools/screenshots"),
+        watchdog: Optional[ResourceWatchdog] = None,
+        speculator: Optional[Speculator] = None,
+        product_store: Optional[ProductStore] = None,
 ) -> WebAgent:
 
     agent = get_agent(
         headless=headless, url=url, slow_mo_ms=slow_mo_ms, viewport=viewport, user_agent=user_agent,
-        screenshot_path=screenshot_path
+        screenshot_path=screenshot_path, watchdog=watchdog, speculator=speculator,
+        product_store=product_store,
     )
 
     return agent
@@ -185,7 +193,10 @@ class GetCurrentURL(BaseTool):
 
     def call(self, params: str, **kwargs) -> List[ContentItem]:
         agent = get_agent()
-        return [ContentItem(text=agent.get_current_url())]
+        url = agent.get_current_url()
+        # Карточки товаров, открытые в сессии, попадают в межсессионный кэш
+        get_product_store().record_url(url, query=get_current_query())
+        return [ContentItem(text=url)]
 
 @register_tool("zoom")
 class Zoom(BaseTool):
@@ -233,6 +244,143 @@ class Zoom(BaseTool):
         )
         return [ContentItem(image=str(path))]
 
+@register_tool("batch_actions")
+class BatchActionsTool(BaseTool):
+    description = (
+        "Runs an ordered list of actions (click, type, scroll, wait, key) in one call and returns "
+        "a per-action status and a single screenshot at the end. Stops at the first failed action. "
+        "Use it for predictable sequences, e.g. close an ad, click the search field, type the query and press Enter."
+    )
+    parameters = [
+        {
+            'name': 'actions',
+            'type': 'array',
+            'description': (
+                "Ordered list of actions. Each item is an object with 'type' and its arguments: "
+                "{'type': 'click', 'x': int, 'y': int, 'button': 'left'|'right'|'middle', 'click_count': int}, "
+                "{'type': 'type', 'text': str, 'press_enter': bool, 'clear_before': bool} "
+                "(press_enter and clear_before default to true, like in type_text), "
+                "{'type': 'scroll', 'delta_x': int, 'delta_y': int}, "
+                "{'type': 'wait', 'ms': int}, "
+                "{'type': 'key', 'key': str} (e.g. 'Enter', 'Escape'). "
+                "Coordinates are from 0 to 1000, scroll deltas follow the scroll tool (positive delta_y = up)."
+            ),
+            'items': {'type': 'object'},
+            'required': True
+        },
+    ]
+
+    def call(self, params: str, **kwargs) -> List[ContentItem]:
+        args = json5.loads(params)
+        actions = args.get('actions')
+        if not isinstance(actions, list):
+            return [ContentItem(text="Error: 'actions' must be a list of action objects.")]
+
+        agent = get_agent()
+        # Направление прокрутки — как в инструменте scroll
+        results, path = agent.batch_actions_and_screenshot(actions=actions, invert_scroll=True)
+        return [
+            ContentItem(text=json5.dumps(results, ensure_ascii=False)),
+            ContentItem(image=str(path)),
+        ]
+
+@register_tool("lookup_cached_products")
+class LookupCachedProductsTool(BaseTool):
+    description = (
+        "Looks up products saved in the local cache by previous sessions for a similar query. "
+        "Returns candidates with product id, title, link, price, rating and review summary. "
+        "Use it BEFORE browsing; cached data may be outdated, verify the chosen product by its link if needed."
+    )
+    parameters = [
+        {
+            'name': 'query',
+            'type': 'string',
+            'description': 'Search query. Defaults to the current user query.',
+            'required': False
+        },
+        {
+            'name': 'limit',
+            'type': 'integer',
+            'description': 'Maximum number of candidates to return.',
+            'required': False
+        },
+    ]
+
+    def call(self, params: str, **kwargs) -> List[ContentItem]:
+        args = json5.loads(params) if params else {}
+        query = args.get('query') or get_current_query()
+        limit = int(args.get('limit', 10))
+
+        candidates = get_product_store().lookup(query, limit=limit)
+        if not candidates:
+            return [ContentItem(text="No cached products for this query.")]
+        return [ContentItem(text=json5.dumps(candidates, ensure_ascii=False))]
+
+
+@register_tool("save_product")
+class SaveProductTool(BaseTool):
+    description = (
+        "Saves a review summary of a product to the local cache, so that later sessions with similar queries "
+        "can reuse it. Prices, ratings and links of products on the page are saved automatically, "
+        "call this only after reading the reviews."
+    )
+    parameters = [
+        {
+            'name': 'url',
+            'type': 'string',
+            'description': 'Link to the product card, e.g. https://www.wildberries.ru/catalog/<id>/detail.aspx.',
+            'required': False
+        },
+        {
+            'name': 'product_id',
+            'type': 'string',
+            'description': 'Product id (article). Required if url is not given.',
+            'required': False
+        },
+        {
+            'name': 'title',
+            'type': 'string',
+            'description': 'Product title.',
+            'required': False
+        },
+        {
+            'name': 'price',
+            'type': 'number',
+            'description': 'Price in rubles.',
+            'required': False
+        },
+        {
+            'name': 'rating',
+            'type': 'number',
+            'description': 'Rating from 0 to 5.',
+            'required': False
+        },
+        {
+            'name': 'review_summary',
+            'type': 'string',
+            'description': 'Short summary of the reviews.',
+            'required': False
+        },
+    ]
+
+    def call(self, params: str, **kwargs) -> List[ContentItem]:
+        args = json5.loads(params) if params else {}
+        url = args.get('url')
+        product_id = args.get('product_id') or product_id_from_url(url)
+        if not product_id:
+            return [ContentItem(text="Error: either url or product_id is required.")]
+
+        get_product_store().upsert(
+            product_id=str(product_id),
+            query=get_current_query(),
+            title=args.get('title'),
+            url=url,
+            price=args.get('price'),
+            rating=args.get('rating'),
+            review_summary=args.get('review_summary'),
+        )
+        return [ContentItem(text=f"Saved product {product_id}.")]
+
 def make_web_tools(agent: WebAgent | None = None) -> list[BaseTool]:
     """Возвращает список зарегистрированных web-tools.
 
@@ -247,4 +395,7 @@ def make_web_tools(agent: WebAgent | None = None) -> list[BaseTool]:
         GoBackTool(),
         GetCurrentURL(),
         Zoom(),
+        BatchActionsTool(),
+        LookupCachedProductsTool(),
+        SaveProductTool(),
     ]
\ No newline at end of file
@@ -0,0 +1,110 @@
+"""
+Product Extraction — данные товаров из DOM страницы Wildberries для кэша товаров
+
+Возможности:
+- Извлекает видимые карточки товаров в выдаче (ссылка, название, цена, рейтинг)
+- Извлекает данные открытой карточки товара
+- Пишет извлечённое в кэш товаров без участия модели (только чтение DOM).
+  К поисковому запросу привязываются только карточки выдачи по этому запросу, остальные товары
+  (рекомендации на главной, реклама, открытые карточки) индексируются только по названию.
+"""
+from __future__ import annotations
+
+from typing import Optional, Any
+
+from playwright.sync_api import Page
+
+from .product_store import ProductStore, product_id_from_url, search_text_from_url
+
+# Данные видимых карточек товаров в выдаче
+_EXTRACT_CARDS_JS = """
+() => {
+  const cards = [];
+  const seen = new Set();
+  for (const a of document.querySelectorAll('a[href*="/catalog/"][href*="/detail"]')) {
+    const r = a.getBoundingClientRect();
+    if (r.bottom < 0 || r.top > window.innerHeight || r.width === 0) continue;
+    const href = a.href.split('?')[0];
+    if (seen.has(href)) continue;
+    seen.add(href);
+    const card = a.closest('article') || a.parentElement;
+    const text = (sel) => { const el = card && card.querySelector(sel); return el ? el.textContent.trim() : null; };
+    cards.push({
+      url: href,
+      title: a.getAttribute('aria-label') || text('.product-card__name') || a.textContent.trim() || null,
+      price: text('.price__lower-price'),
+      rating: text('.address-rate-mini'),
+    });
+  }
+  return cards;
+}
+"""
+
+# Данные открытой карточки товара
+_EXTRACT_PRODUCT_JS = """
+() => {
+  const text = (sel) => { const el = document.querySelector(sel); return el ? el.textContent.trim() : null; };
+  return {
+    title: text('h1'),
+    price: text('.price-block__final-price') || text('[class*="price"]'),
+    rating: text('.product-review__rating') || text('[class*="rating"]'),
+  };
+}
+"""
+
+
+def parse_number(text: Optional[str]) -> Optional[float]:
+    """Достаёт число из текста вида «1 999 ₽» или «4,8»."""
+    if not text:
+        return None
+    digits = "".join(ch for ch in text.replace(",", ".") if ch.isdigit() or ch == ".").strip(".")
+    try:
+        return float(digits) if digits else None
+    except ValueError:
+        return None
+
+
+def extract_visible_cards(page: Page) -> list[dict[str, Any]]:
+    """Видимые во viewport карточки товаров: url, title, price, rating (цена и рейтинг — числа или None)."""
+    cards = []
+    for card in page.evaluate(_EXTRACT_CARDS_JS):
+        cards.append({
+            "url": card.get("url"),
+            "title": card.get("title"),
+            "price": parse_number(card.get("price")),
+            "rating": parse_number(card.get("rating")),
+        })
+    return cards
+
+
+def extract_product(page: Page) -> dict[str, Any]:
+    """Данные открытой карточки товара: title, price, rating."""
+    data = page.evaluate(_EXTRACT_PRODUCT_JS)
+    return {
+        "title": data.get("title"),
+        "price": parse_number(data.get("price")),
+        "rating": parse_number(data.get("rating")),
+    }
+
+
+def save_page_products(page: Page, store: ProductStore) -> int:
+    """Пишет в кэш товары текущей страницы: открытую карточку или видимые карточки.
+
+    Карточки на странице поисковой выдачи привязываются к её запросу (из URL), остальные — только к названию.
+    Возвращает число сохранённых товаров.
+    """
+    url = page.url.split("?")[0]
+    product_id = product_id_from_url(url)
+    if product_id is not None:
+        store.upsert(product_id=product_id, url=url, **extract_product(page))
+        return 1
+
+    query = search_text_from_url(page.url) or ""
+    saved = 0
+    for card in extract_visible_cards(page):
+        card_id = product_id_from_url(card["url"])
+        if card_id is None:
+            continue
+        store.upsert(product_id=card_id, query=query, **card)
+        saved += 1
+    return saved
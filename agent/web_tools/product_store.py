@@ -0,0 +1,318 @@
+"""
+Product Store — локальный межсессионный кэш товаров на SQLite
+
+Возможности:
+- Хранит карточки товаров (цена, рейтинг, краткое содержание отзывов, ссылка) с TTL
+- Индексирует товары по product id и нормализованным термам запросов
+- Ищет закэшированных кандидатов по текущему запросу пользователя
+- Ограничивает размер хранилища, вытесняя давно не использованные записи
+- Считает метрики попаданий/промахов и вытеснений
+"""
+from __future__ import annotations
+
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Any
+from urllib.parse import urlsplit, parse_qs
+
+_WORD_RE = re.compile(r"[0-9a-zа-я]+")
+_PRODUCT_URL_RE = re.compile(r"/catalog/(\d+)/detail")
+_STOP_WORDS = {
+    "и", "в", "на", "с", "до", "от", "для", "по", "за", "из", "без", "или", "не", "the", "a", "for",
+    "дешевле", "дороже", "руб", "рубля", "рублей",
+}
+# Слова, после которых число — ограничение цены, а не терм («до 3000», «от 1000»)
+_PRICE_MAX_WORDS = {"до", "дешевле"}
+_PRICE_MIN_WORDS = {"от", "дороже"}
+# Пробел (в том числе неразрывный) между группами разрядов: «3 000» -> «3000»
+_DIGIT_GROUP_RE = re.compile(r"(?<=\d)[ \u00a0\u202f](?=\d{3}(?!\d))")
+# Грубый стемминг: «зеленый», «зеленые», «зеленая» -> «зелен»
+_STEM_LEN = 5
+
+
+def _words(text: str) -> list[str]:
+    """Слова текста в нижнем регистре, ё -> е, числа с разделителем разрядов склеены."""
+    text = _DIGIT_GROUP_RE.sub("", (text or "").lower().replace("ё", "е"))
+    return _WORD_RE.findall(text)
+
+
+def normalize_terms(text: str) -> list[str]:
+    """Приводит текст к списку нормализованных термов (нижний регистр, ё -> е, обрезка окончаний)."""
+    terms: list[str] = []
+    words = _words(text)
+    for i, word in enumerate(words):
+        if word in _STOP_WORDS:
+            continue
+        if word.isdigit() and i > 0 and words[i - 1] in _PRICE_MAX_WORDS | _PRICE_MIN_WORDS:
+            # Ограничение цены учитывается фильтром в lookup, а не термом
+            continue
+        if not word.isdigit():
+            if len(word) < 2:
+                continue
+            word = word[:_STEM_LEN]
+        if word not in terms:
+            terms.append(word)
+    return terms
+
+
+def parse_price_range(text: str) -> tuple[Optional[float], Optional[float]]:
+    """Достаёт из запроса ограничения цены: «от 1000 до 3 000» -> (1000, 3000)."""
+    words = _words(text)
+    price_min: Optional[float] = None
+    price_max: Optional[float] = None
+    for prev, word in zip(words, words[1:]):
+        if not word.isdigit():
+            continue
+        if prev in _PRICE_MAX_WORDS:
+            price_max = float(word)
+        elif prev in _PRICE_MIN_WORDS:
+            price_min = float(word)
+    return price_min, price_max
+
+
+def product_id_from_url(url: str) -> Optional[str]:
+    """Достаёт артикул товара из ссылки вида https://www.wildberries.ru/catalog/<id>/detail.aspx."""
+    match = _PRODUCT_URL_RE.search(url or "")
+    return match.group(1) if match else None
+
+
+def search_text_from_url(url: str) -> Optional[str]:
+    """Достаёт поисковый запрос из ссылки на выдачу вида https://www.wildberries.ru/catalog/0/search.aspx?search=<запрос>."""
+    parts = urlsplit(url or "")
+    if not parts.path.endswith("/search.aspx"):
+        return None
+    values = parse_qs(parts.query).get("search")
+    return values[0] if values else None
+
+
+class ProductStore:
+    """Кэш товаров поверх SQLite.
+
+    Параметры конструктора:
+      - db_path: путь к файлу базы (":memory:" — база в памяти)
+      - ttl_s: время жизни записи в секундах
+      - max_entries: максимальное число товаров, сверх него вытесняются давно не использованные
+    """
+
+    def __init__(
+        self,
+        db_path: Path | str = Path("product_cache.sqlite3"),
+        ttl_s: int = 24 * 3600,
+        max_entries: int = 5000,
+    ) -> None:
+        if str(db_path) != ":memory:":
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        self._metrics = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "expired": 0}
+        self._create_schema()
+
+    # --------------------------- Публичные операции ---------------------------
+    def upsert(
+        self,
+        product_id: str,
+        query: str = "",
+        title: Optional[str] = None,
+        url: Optional[str] = None,
+        price: Optional[float] = None,
+        rating: Optional[float] = None,
+        review_summary: Optional[str] = None,
+    ) -> None:
+        """Добавляет или обновляет товар. Пустые поля не затирают уже сохранённые значения."""
+        now = time.time()
+        terms = normalize_terms(f"{query} {title or ''}")
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO products (product_id, title, url, price, rating, review_summary,
+                                      updated_at, expires_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(product_id) DO UPDATE SET
+                    title = COALESCE(excluded.title, products.title),
+                    url = COALESCE(excluded.url, products.url),
+                    price = COALESCE(excluded.price, products.price),
+                    rating = COALESCE(excluded.rating, products.rating),
+                    review_summary = COALESCE(excluded.review_summary, products.review_summary),
+                    updated_at = excluded.updated_at,
+                    expires_at = excluded.expires_at,
+                    last_access = excluded.last_access
+                """,
+                (str(product_id), title, url, price, rating, review_summary, now, now + self.ttl_s, now),
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO product_terms (term, product_id) VALUES (?, ?)",
+                [(term, str(product_id)) for term in terms],
+            )
+            self._metrics["writes"] += 1
+            self._evict(now)
+
+    def record_url(self, url: str, query: str = "") -> Optional[str]:
+        """Сохраняет ссылку на карточку товара, если URL на неё указывает. Возвращает артикул."""
+        product_id = product_id_from_url(url)
+        if product_id is not None:
+            self.upsert(product_id, query=query, url=url)
+        return product_id
+
+    def lookup(self, query: str, limit: int = 10) -> list[dict[str, Any]]:
+        """Возвращает неистёкших кандидатов, подходящих по цене, если она задана в запросе («до 3000»).
+
+        Сначала идут товары, совпавшие по всем термам запроса, затем частичные совпадения;
+        внутри — по числу совпавших термов и рейтингу. Товары с неизвестной ценой не отбрасываются.
+        """
+        terms = normalize_terms(query)
+        price_min, price_max = parse_price_range(query)
+        if not terms:
+            with self._lock:
+                self._metrics["misses"] += 1
+            return []
+
+        now = time.time()
+        placeholders = ", ".join("?" for _ in terms)
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                f"""
+                SELECT p.*, COUNT(t.term) AS matched
+                FROM product_terms t
+                JOIN products p ON p.product_id = t.product_id
+                WHERE t.term IN ({placeholders}) AND p.expires_at > ?
+                  AND (? IS NULL OR p.price IS NULL OR p.price >= ?)
+                  AND (? IS NULL OR p.price IS NULL OR p.price <= ?)
+                GROUP BY p.product_id
+                ORDER BY matched = ? DESC, matched DESC, p.rating IS NULL, p.rating DESC, p.updated_at DESC
+                LIMIT ?
+                """,
+                (*terms, now, price_min, price_min, price_max, price_max, len(terms), limit),
+            ).fetchall()
+            if rows:
+                self._conn.executemany(
+                    "UPDATE products SET last_access = ? WHERE product_id = ?",
+                    [(now, row["product_id"]) for row in rows],
+                )
+                self._metrics["hits"] += 1
+            else:
+                self._metrics["misses"] += 1
+
+        return [
+            {
+                "product_id": row["product_id"],
+                "title": row["title"],
+                "url": row["url"],
+                "price": row["price"],
+                "rating": row["rating"],
+                "review_summary": row["review_summary"],
+                "matched_terms": row["matched"],
+                "age_s": int(now - row["updated_at"]),
+            }
+            for row in rows
+        ]
+
+    def metrics(self) -> dict[str, Any]:
+        """Счётчики попаданий/промахов, вытеснений и текущий размер хранилища."""
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+            lookups = self._metrics["hits"] + self._metrics["misses"]
+            return {
+                **self._metrics,
+                "size": size,
+                "max_entries": self.max_entries,
+                "hit_rate": self._metrics["hits"] / lookups if lookups else 0.0,
+            }
+
+    def close(self) -> None:
+        """Закрыть соединение с базой."""
+        with self._lock:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+
+    def _create_schema(self) -> None:
+        with self._lock, self._conn:
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS products (
+                    product_id     TEXT PRIMARY KEY,
+                    title          TEXT,
+                    url            TEXT,
+                    price          REAL,
+                    rating         REAL,
+                    review_summary TEXT,
+                    updated_at     REAL NOT NULL,
+                    expires_at     REAL NOT NULL,
+                    last_access    REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS product_terms (
+                    term       TEXT NOT NULL,
+                    product_id TEXT NOT NULL REFERENCES products(product_id) ON DELETE CASCADE,
+                    PRIMARY KEY (term, product_id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_product_terms_product ON product_terms(product_id);
+                CREATE INDEX IF NOT EXISTS idx_products_expires ON products(expires_at);
+                CREATE INDEX IF NOT EXISTS idx_products_last_access ON products(last_access);
+                """
+            )
+
+    def _evict(self, now: float) -> None:
+        """Удаляет истёкшие записи и, при превышении max_entries, давно не использованные. Вызывать под lock.
+
+        Термы удаляются каскадно (foreign key ON DELETE CASCADE).
+        """
+        expired = self._conn.execute("DELETE FROM products WHERE expires_at <= ?", (now,)).rowcount
+        self._metrics["expired"] += max(0, expired)
+
+        size = self._conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+        overflow = size - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                """
+                DELETE FROM products WHERE product_id IN (
+                    SELECT product_id FROM products ORDER BY last_access ASC LIMIT ?
+                )
+                """,
+                (overflow,),
+            )
+            self._metrics["evictions"] += overflow
+
+
+# --------------------------- Модульный синглтон ---------------------------
+_store_singleton: Optional[ProductStore] = None
+_current_query: str = ""
+
+
+def get_product_store(
+    db_path: Path | str = Path("product_cache.sqlite3"),
+    ttl_s: int = 24 * 3600,
+    max_entries: int = 5000,
+) -> ProductStore:
+    """Возвращает единый экземпляр кэша товаров (создаётся при первом вызове)."""
+    global _store_singleton
+    if _store_singleton is None:
+        _store_singleton = ProductStore(db_path=db_path, ttl_s=ttl_s, max_entries=max_entries)
+    return _store_singleton
+
+
+def close_product_store() -> None:
+    """Явно закрыть singleton-кэш."""
+    global _store_singleton
+    if _store_singleton is not None:
+        try:
+            _store_singleton.close()
+        finally:
+            _store_singleton = None
+
+
+def set_current_query(query: str) -> None:
+    """Запоминает запрос текущей сессии — к нему привязываются товары, открытые и сохранённые моделью."""
+    global _current_query
+    _current_query = query or ""
+
+
+def get_current_query() -> str:
+    return _current_query
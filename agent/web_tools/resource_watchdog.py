@@ -0,0 +1,136 @@
+"""
+Resource Watchdog — контроль памяти Chromium и автоматический перезапуск
+
+Возможности:
+- Снимает показатели страницы через CDP Performance.getMetrics (JS heap, DOM-узлы, документы)
+- Снимает память процессов браузера (SystemInfo.getProcessInfo + PSS из /proc, без двойного учёта общей памяти)
+- Считает количество открытых страниц
+- При превышении порогов пересоздаёт контекст или весь браузер, сохраняя текущий URL
+- Отдаёт последние показания и счётчики перезапусков как метрики
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Optional, Any, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .web_agent_tools import WebAgent
+
+
+class ResourceWatchdog:
+    """Сторож ресурсов браузера.
+
+    Параметры конструктора (None — порог не проверяется):
+      - max_js_heap_mb: предел используемого JS heap страницы -> перезапуск контекста
+      - max_dom_nodes: предел числа DOM-узлов -> перезапуск контекста
+      - max_pages: предел открытых страниц во всех контекстах -> перезапуск контекста
+      - max_browser_pss_mb: предел суммарного PSS процессов браузера -> перезапуск браузера.
+        По умолчанию не проверяется: перезапуск браузера теряет состояние страницы (введённый текст, фильтры)
+      - check_interval_s: минимальный интервал между замерами
+    """
+
+    def __init__(
+        self,
+        max_js_heap_mb: Optional[float] = 512,
+        max_dom_nodes: Optional[int] = 200_000,
+        max_pages: Optional[int] = 5,
+        max_browser_pss_mb: Optional[float] = None,
+        check_interval_s: float = 10.0,
+    ) -> None:
+        self.max_js_heap_mb = max_js_heap_mb
+        self.max_dom_nodes = max_dom_nodes
+        self.max_pages = max_pages
+        self.max_browser_pss_mb = max_browser_pss_mb
+        self.check_interval_s = check_interval_s
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+        self._last_reading: dict[str, Any] = {}
+        self._metrics = {
+            "checks": 0, "context_recycles": 0, "browser_recycles": 0, "url_fallbacks": 0, "errors": 0,
+        }
+        self._last_recycle_reason: Optional[str] = None
+
+    # --------------------------- Публичные операции ---------------------------
+    def check(self, agent: WebAgent, force: bool = False) -> Optional[str]:
+        """Снимает показания и при необходимости перезапускает контекст/браузер.
+
+        Вызывается между шагами агента. Возвращает 'context' | 'browser', если был перезапуск, иначе None.
+        """
+        now = time.time()
+        if not force and now - self._last_check < self.check_interval_s:
+            return None
+        self._last_check = now
+
+        try:
+            reading = agent.sample_resources()
+        except Exception:
+            with self._lock:
+                self._metrics["errors"] += 1
+            return None
+
+        with self._lock:
+            self._metrics["checks"] += 1
+            self._last_reading = {**reading, "sampled_at": now}
+
+        level, reason = self._decide(reading)
+        if level is None:
+            return None
+
+        try:
+            restored = agent.recycle(level=level)
+        except Exception:
+            with self._lock:
+                self._metrics["errors"] += 1
+            return None
+
+        with self._lock:
+            self._metrics[f"{level}_recycles"] += 1
+            if not restored:
+                # Текущий URL не открылся — агент вернулся на стартовую страницу
+                self._metrics["url_fallbacks"] += 1
+            self._last_recycle_reason = reason
+        return level
+
+    def metrics(self) -> dict[str, Any]:
+        """Последние показания и счётчики перезапусков."""
+        with self._lock:
+            return {
+                **self._metrics,
+                "last_reading": dict(self._last_reading),
+                "last_recycle_reason": self._last_recycle_reason,
+            }
+
+    def _decide(self, reading: dict[str, Any]) -> tuple[Optional[str], Optional[str]]:
+        pss = reading.get("browser_pss_mb")
+        if self.max_browser_pss_mb is not None and pss is not None and pss > self.max_browser_pss_mb:
+            return "browser", f"browser_pss_mb={pss:.0f} > {self.max_browser_pss_mb}"
+
+        heap = reading.get("js_heap_used_mb")
+        if self.max_js_heap_mb is not None and heap is not None and heap > self.max_js_heap_mb:
+            return "context", f"js_heap_used_mb={heap:.0f} > {self.max_js_heap_mb}"
+
+        nodes = reading.get("dom_nodes")
+        if self.max_dom_nodes is not None and nodes is not None and nodes > self.max_dom_nodes:
+            return "context", f"dom_nodes={nodes} > {self.max_dom_nodes}"
+
+        pages = reading.get("pages")
+        if self.max_pages is not None and pages is not None and pages > self.max_pages:
+            return "context", f"pages={pages} > {self.max_pages}"
+
+        return None, None
+
+
+def read_process_pss_mb(pid: int) -> Optional[float]:
+    """PSS процесса в мегабайтах из /proc/<pid>/smaps_rollup (Linux). None, если недоступно.
+
+    В отличие от RSS, общая между процессами память делится между ними, поэтому PSS процессов можно суммировать.
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
@@ -0,0 +1,427 @@
+"""
+Speculator — спекулятивная подготовка результатов, пока модель генерирует следующий ход
+
+Playwright sync API однопоточный, поэтому работа выполняется короткими шагами (не дольше max_task_ms)
+в том же потоке, между чанками потокового ответа модели (см. on_idle). Страница, которую видит модель,
+никогда не прокручивается и не перезагружается — с ней возможна только работа на чтение:
+- Заранее отрисовывает следующий экран прокрутки во вспомогательной (offscreen) странице: открывает тот же URL,
+  прокручивает до следующей позиции и делает снимок. Навигация запускается без ожидания (location.href),
+  готовность проверяется на следующих шагах. Снимок отдаётся сразу, если следующий вызов scroll совпадает
+  и «подпись» живой страницы после прокрутки совпадает с отрисованной: видимые карточки, значения видимых полей
+  ввода, число открытых попапов/модальных окон и элемент под указателем. Иначе это промах, причина
+  расхождения считается в метриках (scroll_miss_*).
+  Подпись не покрывает всё: анимации, карусели, ещё не догруженные изображения и стили наведения могут
+  отличаться, и модель увидит их на снимке такими, какими они были в отрисовке.
+- Опционально (prefetch_cards, по умолчанию выключено) открывает карточку товара под указателем в отдельном
+  одноразовом контексте без cookies агента — не затрагивая историю просмотров и аналитику сессии —
+  и извлекает из неё данные товара в кэш. Кэш HTTP между контекстами не общий, поэтому живую страницу
+  это не ускоряет.
+- Считает попадания, промахи и впустую потраченное время (шаги, задержавшие поток ответа модели).
+"""
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Any, TYPE_CHECKING
+
+from playwright.sync_api import Page, BrowserContext
+
+from .product_extraction import extract_product
+from .product_store import get_product_store, product_id_from_url
+
+if TYPE_CHECKING:
+    from .web_agent_tools import WebAgent
+
+# Ссылка на карточку товара под точкой (x, y)
+_LINK_AT_POINT_JS = """
+([x, y]) => {
+  const el = document.elementFromPoint(x, y);
+  const card = el && (el.closest('a[href*="/catalog/"][href*="/detail"]')
+    || (el.closest('article') && el.closest('article').querySelector('a[href*="/catalog/"][href*="/detail"]')));
+  return card ? card.href.split('?')[0] : null;
+}
+"""
+
+# «Подпись» экрана для сверки отрисовки с живой страницей: видимые карточки товаров, значения видимых полей
+# ввода, число видимых попапов/модальных окон и карточка (или тег) под указателем
+_VISIBLE_SIGNATURE_JS = """
+(pointer) => {
+  const visible = (el) => {
+    const r = el.getBoundingClientRect();
+    if (r.width === 0 || r.height === 0 || r.bottom <= 0 || r.top >= window.innerHeight) return false;
+    const style = getComputedStyle(el);
+    return style.visibility !== 'hidden' && style.display !== 'none' && style.opacity !== '0';
+  };
+  const cardOf = (el) => {
+    const a = el && el.closest('a[href*="/catalog/"][href*="/detail"]');
+    return a ? a.href.split('?')[0] : null;
+  };
+  const cards = [];
+  for (const a of document.querySelectorAll('a[href*="/catalog/"][href*="/detail"]')) {
+    const href = a.href.split('?')[0];
+    if (visible(a) && !cards.includes(href)) cards.push(href);
+  }
+  const inputs = [...document.querySelectorAll('input:not([type="hidden"]), textarea')]
+    .filter(visible).map((el) => el.value);
+  const overlays = [...document.querySelectorAll(
+    '[role="dialog"], [aria-modal="true"], dialog[open], [class*="popup"], [class*="modal"]'
+  )].filter(visible).length;
+  let at_pointer = null;
+  if (pointer) {
+    const el = document.elementFromPoint(pointer[0], pointer[1]);
+    at_pointer = el ? (cardOf(el) || el.tagName) : null;
+  }
+  return {cards, inputs, overlays, at_pointer};
+}
+"""
+
+_SCROLL_STATE_JS = (
+    "() => [location.href, Math.round(window.scrollX), Math.round(window.scrollY),"
+    " document.documentElement.scrollHeight, window.innerHeight]"
+)
+
+# Навигация без ожидания: старый документ помечается, чтобы не принять его readyState за новый
+_NAVIGATE_JS = "(url) => { window.__specStale = true; location.href = url; }"
+_READY_STATE_JS = "() => window.__specStale ? 'stale' : document.readyState"
+
+# Если следующий чанк ответа пришёл быстрее этого после окончания шага, шаг задержал поток
+_BUFFERED_CHUNK_MS = 5.0
+
+
+@dataclass
+class PreparedScroll:
+    delta: tuple[int, int]
+    fingerprint: tuple
+    target_scroll: tuple[int, int]
+    signature: dict[str, Any]
+    path: Path
+    prepared_at: float
+
+
+@dataclass
+class _PendingRender:
+    delta: tuple[int, int]
+    fingerprint: tuple
+    target_scroll: tuple[int, int]
+    started_at: float
+    scrolled: bool = False
+
+
+class Speculator:
+    """Спекулятивная подготовка результатов инструментов.
+
+    Параметры конструктора:
+      - scroll_delta: прокрутка (wheel), для которой готовится снимок, пока модель не прокручивала сама
+      - ttl_s: время жизни подготовленного снимка и незавершённой отрисовки
+      - max_task_ms: предел времени одного шага (таймауты снимка и навигационных проверок)
+      - prefetch_cards: открывать ли карточку товара под указателем в одноразовом контексте
+    """
+
+    def __init__(
+        self,
+        scroll_delta: tuple[int, int] = (0, 1000),
+        ttl_s: float = 30.0,
+        max_task_ms: int = 300,
+        prefetch_cards: bool = False,
+    ) -> None:
+        self.scroll_delta = scroll_delta
+        self.ttl_s = ttl_s
+        self.max_task_ms = max_task_ms
+        self.prefetch_cards = prefetch_cards
+        self._tasks: list[str] = []
+        self._scroll: Optional[PreparedScroll] = None
+        self._render: Optional[_PendingRender] = None
+        self._prefetch_url: Optional[str] = None
+        self._prefetch_started_at = 0.0
+        self._prefetched: set[str] = set()
+        self._render_page: Optional[Page] = None
+        self._prefetch_context: Optional[BrowserContext] = None
+        self._prefetch_page: Optional[Page] = None
+        self._counter = 0
+        self._last_task_ms = 0.0
+        self._last_task_end: Optional[float] = None
+        self._metrics = {
+            "tasks": 0,
+            "task_errors": 0,
+            "work_ms": 0.0,
+            "wasted_ms": 0.0,
+            "scroll_prepared": 0,
+            "scroll_hits": 0,
+            "scroll_misses": 0,
+            "scroll_miss_cards": 0,
+            "scroll_miss_inputs": 0,
+            "scroll_miss_overlays": 0,
+            "scroll_miss_at_pointer": 0,
+            "scroll_wasted": 0,
+            "prefetched": 0,
+            "prefetch_hits": 0,
+        }
+
+    # --------------------------- Публичные операции ---------------------------
+    def on_action(self, agent: WebAgent) -> None:
+        """Вызывается после каждого действия агента: сбрасывает устаревшие результаты и планирует новые."""
+        if self._scroll is not None:
+            # Подготовленный снимок не был использован до следующего действия
+            self._metrics["scroll_wasted"] += 1
+            self._scroll = None
+        self._render = None
+        self._prefetch_url = None
+
+        try:
+            url = agent.page.url.split("?")[0]
+        except Exception:
+            url = None
+        if url in self._prefetched:
+            self._metrics["prefetch_hits"] += 1
+            self._prefetched.discard(url)
+
+        self._tasks = ["render_start"]
+        if self.prefetch_cards:
+            self._tasks.append("prefetch_start")
+
+    def on_chunk(self) -> None:
+        """Вызывается при получении каждого чанка ответа модели, до его обработки.
+
+        Если чанк пришёл сразу после предыдущего шага, значит модель успела ответить, пока шаг
+        выполнялся, и он задержал поток — его время учитывается как wasted_ms.
+        """
+        if self._last_task_end is not None:
+            if (time.perf_counter() - self._last_task_end) * 1000 < _BUFFERED_CHUNK_MS:
+                self._metrics["wasted_ms"] += self._last_task_ms
+            self._last_task_end = None
+
+    def on_idle(self, agent: WebAgent) -> bool:
+        """Выполняет один короткий шаг запланированной работы. Возвращает True, если шаг был выполнен."""
+        if not self._tasks:
+            return False
+        now = time.perf_counter()
+        task = self._tasks.pop(0)
+        try:
+            if task == "render_start":
+                self._render_start(agent)
+            elif task == "render_step":
+                self._render_step(agent)
+            elif task == "prefetch_start":
+                self._prefetch_start(agent)
+            elif task == "prefetch_step":
+                self._prefetch_step(agent)
+        except Exception:
+            self._metrics["task_errors"] += 1
+        finally:
+            self._last_task_end = time.perf_counter()
+            self._last_task_ms = (self._last_task_end - now) * 1000
+            self._metrics["tasks"] += 1
+            self._metrics["work_ms"] += self._last_task_ms
+        return True
+
+    def take_scroll(self, agent: WebAgent, delta_x: int, delta_y: int) -> Optional[PreparedScroll]:
+        """Возвращает подготовленный снимок, если он соответствует текущему состоянию страницы и прокрутке.
+
+        Вызывающий обязан выполнить саму прокрутку и проверить результат через matches().
+        """
+        prepared, self._scroll = self._scroll, None
+        if prepared is None:
+            return None
+        if (
+            prepared.delta != (delta_x, delta_y)
+            or time.time() - prepared.prepared_at > self.ttl_s
+            or self._fingerprint(agent.page) != prepared.fingerprint
+        ):
+            self._metrics["scroll_wasted"] += 1
+            return None
+        return prepared
+
+    def matches(self, agent: WebAgent, prepared: PreparedScroll) -> bool:
+        """Совпадает ли подпись живой страницы после прокрутки с отрисованной заранее.
+
+        Каждое расхождение учитывается в метрике scroll_miss_<поле>.
+        """
+        try:
+            signature = agent.page.evaluate(_VISIBLE_SIGNATURE_JS, self._pointer(agent))
+        except Exception:
+            return False
+        mismatched = [key for key, value in prepared.signature.items() if signature.get(key) != value]
+        for key in mismatched:
+            self._metrics[f"scroll_miss_{key}"] += 1
+        return not mismatched
+
+    def record_scroll(self, hit: Optional[bool], delta: tuple[int, int]) -> None:
+        """Учитывает итог использования подготовленного снимка (None — снимка не было) и запоминает прокрутку модели."""
+        if hit is not None:
+            self._metrics["scroll_hits" if hit else "scroll_misses"] += 1
+        self.scroll_delta = delta
+
+    def metrics(self) -> dict[str, Any]:
+        """Счётчики попаданий, промахов и потраченной впустую работы."""
+        used = self._metrics["scroll_hits"] + self._metrics["scroll_misses"] + self._metrics["scroll_wasted"]
+        return {
+            **self._metrics,
+            "scroll_hit_rate": self._metrics["scroll_hits"] / used if used else 0.0,
+        }
+
+    def close(self) -> None:
+        """Закрыть вспомогательные страницы и одноразовый контекст предзагрузки."""
+        for closable in (self._render_page, self._prefetch_page, self._prefetch_context):
+            try:
+                if closable is not None:
+                    closable.close()
+            except Exception:
+                pass
+        self._render_page = None
+        self._prefetch_page = None
+        self._prefetch_context = None
+
+    # --------------------------- Задачи ---------------------------
+    def _render_start(self, agent: WebAgent) -> None:
+        """Запускает (без ожидания) загрузку текущего URL во вспомогательной странице отрисовки."""
+        fingerprint = self._fingerprint(agent.page)
+        url, scroll_x, scroll_y, scroll_height, inner_height = fingerprint
+        dx, dy = self.scroll_delta
+        target = (max(0, scroll_x + dx), min(max(0, scroll_y + dy), max(0, scroll_height - inner_height)))
+        if target == (scroll_x, scroll_y):
+            # Прокручивать некуда
+            return
+
+        page = self._offscreen_page(agent, "_render_page")
+        page.evaluate(_NAVIGATE_JS, url)
+        self._render = _PendingRender(
+            delta=(dx, dy), fingerprint=fingerprint, target_scroll=target, started_at=time.time(),
+        )
+        self._tasks.insert(0, "render_step")
+
+    def _render_step(self, agent: WebAgent) -> None:
+        """Один шаг отрисовки: дождаться загрузки, прокрутить, на следующем шаге — снять экран."""
+        render = self._render
+        if render is None:
+            return
+        if time.time() - render.started_at > self.ttl_s:
+            self._render = None
+            return
+
+        page = self._render_page
+        try:
+            ready = page.evaluate(_READY_STATE_JS)
+        except Exception:
+            # Навигация ещё идёт — контекст выполнения пересоздаётся
+            ready = None
+        if ready != "complete":
+            self._tasks.append("render_step")
+            return
+
+        if not render.scrolled:
+            page.evaluate("([x, y]) => window.scrollTo({left: x, top: y, behavior: 'instant'})",
+                          list(render.target_scroll))
+            render.scrolled = True
+            # Снимок — на следующем шаге, чтобы успели подгрузиться ленивые изображения
+            self._tasks.append("render_step")
+            return
+
+        actual = tuple(page.evaluate("() => [Math.round(window.scrollX), Math.round(window.scrollY)]"))
+        pointer = self._pointer(agent)
+        if pointer is not None:
+            # Указатель живой страницы остаётся на месте при прокрутке — наводим его туда же
+            page.mouse.move(*pointer)
+        signature = page.evaluate(_VISIBLE_SIGNATURE_JS, pointer)
+        self._render = None
+        if actual != render.target_scroll or not signature["cards"]:
+            # Отрисовка не дошла до нужной позиции или на экране нет карточек для сверки
+            return
+
+        path = self._spec_path(agent)
+        page.screenshot(path=str(path), type="png", timeout=self.max_task_ms)
+        self._scroll = PreparedScroll(
+            delta=render.delta,
+            fingerprint=render.fingerprint,
+            target_scroll=render.target_scroll,
+            signature=signature,
+            path=path,
+            prepared_at=time.time(),
+        )
+        self._metrics["scroll_prepared"] += 1
+
+    def _prefetch_start(self, agent: WebAgent) -> None:
+        """Запускает (без ожидания) загрузку карточки товара под указателем во вспомогательной странице."""
+        if agent.last_pointer is None:
+            return
+        url = agent.page.evaluate(_LINK_AT_POINT_JS, list(agent.last_pointer))
+        if not url or url in self._prefetched or url == agent.page.url.split("?")[0]:
+            return
+
+        page = self._isolated_page(agent)
+        page.evaluate(_NAVIGATE_JS, url)
+        self._prefetch_url = url
+        self._prefetch_started_at = time.time()
+        self._tasks.append("prefetch_step")
+
+    def _prefetch_step(self, agent: WebAgent) -> None:
+        """Проверяет загрузку предзагружаемой карточки и извлекает данные товара."""
+        url = self._prefetch_url
+        if url is None or time.time() - self._prefetch_started_at > self.ttl_s:
+            self._prefetch_url = None
+            return
+
+        page = self._prefetch_page
+        try:
+            ready = page.evaluate(_READY_STATE_JS)
+        except Exception:
+            ready = None
+        if ready not in ("interactive", "complete"):
+            self._tasks.append("prefetch_step")
+            return
+
+        self._prefetch_url = None
+        self._prefetched.add(url)
+        self._metrics["prefetched"] += 1
+
+        product_id = product_id_from_url(url)
+        if product_id is not None:
+            # Карточка под указателем не обязательно относится к запросу — индексируется только по названию
+            get_product_store().upsert(product_id=product_id, url=url, **extract_product(page))
+
+    # --------------------------- Вспомогательное ---------------------------
+    def _offscreen_page(self, agent: WebAgent, attr: str) -> Page:
+        """Вспомогательная страница в контексте агента (пересоздаётся после перезапуска контекста)."""
+        context = agent.page.context
+        page: Optional[Page] = getattr(self, attr)
+        if page is None or page.is_closed() or page.context != context:
+            page = context.new_page()
+            page.set_default_timeout(self.max_task_ms)
+            setattr(self, attr, page)
+            # В видимом браузере новая вкладка выходит на передний план
+            agent.page.bring_to_front()
+        return page
+
+    def _isolated_page(self, agent: WebAgent) -> Page:
+        """Страница в одноразовом контексте без cookies агента (пересоздаётся после перезапуска браузера)."""
+        browser = agent.page.context.browser
+        context = self._prefetch_context
+        if context is None or context.browser != browser:
+            if context is not None:
+                try:
+                    context.close()
+                except Exception:
+                    pass
+            context = self._prefetch_context = agent.new_isolated_context()
+            self._prefetch_page = None
+        page = self._prefetch_page
+        if page is None or page.is_closed():
+            page = self._prefetch_page = context.new_page()
+            page.set_default_timeout(self.max_task_ms)
+            agent.page.bring_to_front()
+        return page
+
+    @staticmethod
+    def _pointer(agent: WebAgent) -> Optional[list[int]]:
+        return list(agent.last_pointer) if agent.last_pointer is not None else None
+
+    def _spec_path(self, agent: WebAgent) -> Path:
+        agent.screenshot_path.mkdir(parents=True, exist_ok=True)
+        self._counter += 1
+        ts = time.strftime("%Y%m%d-%H%M%S")
+        return agent.screenshot_path / f"wb-spec-{ts}-{self._counter}.png"
+
+    @staticmethod
+    def _fingerprint(page: Page) -> tuple:
+        """Состояние живой страницы, при котором подготовленный результат остаётся верным."""
+        return tuple(page.evaluate(_SCROLL_STATE_JS))
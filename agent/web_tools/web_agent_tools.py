@@ -9,17 +9,26 @@ Web Agent — единый экземпляр Playwright-агента для р
 - Ввод текста по координатам (x, y): сначала клик по (x, y), затем набор текста
 - Скроллит страницу
 - Ожидает указанное число миллисекунд
+- Выполняет пакет действий (клик/ввод/скролл/ожидание/клавиша) с одним скриншотом в конце
+- Снимает показатели памяти браузера и пересоздаёт контекст/браузер без потери текущего URL
+- Опционально отдаёт заранее подготовленные (спекулятивные) результаты прокрутки
+- После каждого скриншота пишет цены, рейтинги и ссылки товаров со страницы в кэш товаров
 """
 from __future__ import annotations
 
 import os
 import time
 from pathlib import Path
-from typing import Optional, Literal
+from typing import Optional, Literal, Any
 
 from playwright.sync_api import Playwright, sync_playwright, Browser, BrowserContext, Page, \
     TimeoutError as PWTimeoutError, ViewportSize
 
+from .product_extraction import save_page_products
+from .product_store import ProductStore
+from .resource_watchdog import ResourceWatchdog, read_process_pss_mb
+from .speculation import Speculator
+
 class WebAgent:
     """Агент, создающий браузер с указанной страницей.
 
@@ -29,6 +38,9 @@ class WebAgent:
       - slow_mo_ms: замедление операций (мс) для наглядности
       - viewport: кортеж (width, height) или None для системного размера окна
       - screenshot_path: путь для сохранения скриншотов
+      - watchdog: сторож ресурсов, проверяется перед каждым скриншотом (None — отключён)
+      - speculator: спекулятивная подготовка результатов между ходами модели (None — отключена)
+      - product_store: кэш товаров, куда после каждого скриншота пишутся товары со страницы (None — не писать)
     """
 
     def __init__(
@@ -39,6 +51,9 @@ class WebAgent:
         viewport: Optional[tuple[int, int]] = (1366, 900),
         user_agent: Optional[str] = None,
         screenshot_path: Path = Path("screenshots"),
+        watchdog: Optional[ResourceWatchdog] = None,
+        speculator: Optional[Speculator] = None,
+        product_store: Optional[ProductStore] = None,
     ) -> None:
         self._playwright_cm = sync_playwright()
         self._pw: Playwright = self._playwright_cm.__enter__()
@@ -47,8 +62,13 @@ class WebAgent:
         self._page: Page | None = None
         self.url = url
         self.screenshot_path = screenshot_path
+        self.watchdog = watchdog
+        self.speculator = speculator
+        self.product_store = product_store
+        # Последняя позиция указателя мыши (x, y) в координатах viewport
+        self.last_pointer: Optional[tuple[int, int]] = None
 
-        self._browser = self._pw.chromium.launch(
+        self._launch_args = dict(
             headless=headless,
             slow_mo=slow_mo_ms or 0,
             args=[
@@ -58,6 +78,7 @@ class WebAgent:
                 "--disable-notifications",
             ],
         )
+        self._browser = self._pw.chromium.launch(**self._launch_args)
 
         context_args = dict(
             locale="ru-RU",
@@ -69,12 +90,9 @@ class WebAgent:
 
         if user_agent:
             context_args["user_agent"] = user_agent
+        self._context_args = context_args
 
-        self._context = self._browser.new_context(**context_args)
-        self._page = self._context.new_page()
-
-        self._page.goto(self.url, wait_until="load")
-        self.wait_until_stable(max_wait_ms=1000)
+        self._open_context(self.url)
 
     # --------------------------- Публичные операции ---------------------------
     @property
@@ -108,12 +126,25 @@ class WebAgent:
         # Тишина DOM (MutationObserver):
         self._wait_for_dom_quiet(quiet_ms=dom_quiet_ms, timeout_ms=_remaining())
 
-    def screenshot(self, screenshot_path: Optional[str | os.PathLike] = None, full_page: bool = False) -> Path:
-        """Сохраняет скриншот страницы и возвращает путь к файлу."""
+    def screenshot(
+        self,
+        screenshot_path: Optional[str | os.PathLike] = None,
+        full_page: bool = False,
+        allow_recycle: bool = True,
+    ) -> Path:
+        """Сохраняет скриншот страницы и возвращает путь к файлу.
+
+        - allow_recycle: разрешить сторожу ресурсов перезапустить контекст/браузер перед снимком
+        """
+        if allow_recycle and self.watchdog is not None:
+            self.watchdog.check(self)
         p = self.page
         out_path = self._ensure_path(screenshot_path)
         self.wait_until_stable()
         p.screenshot(path=str(out_path), full_page=full_page, type="png")
+        self._save_products()
+        if self.speculator is not None:
+            self.speculator.on_action(self)
         return out_path
 
     def click_and_screenshot(
@@ -134,6 +165,7 @@ class WebAgent:
         p = self.page
         # Клик по координатам
         p.mouse.click(x, y, button=button, click_count=click_count)
+        self.last_pointer = (x, y)
         # Навигация/динамика после клика
         self.wait_until_stable()
         return self.screenshot(screenshot_path, full_page=full_page)
@@ -171,6 +203,7 @@ class WebAgent:
 
             # 1) Клик по координатам, чтобы сфокусировать поле
             p.mouse.click(x, y)
+            self.last_pointer = (x, y)
             p.wait_for_timeout(300)
 
         # 2) Опциональная очистка: Ctrl+A + Delete
@@ -206,7 +239,24 @@ class WebAgent:
         - delta_y: Скролл по Y
         """
         p = self.page
+        prepared = None
+        if self.speculator is not None and screenshot_path is None and not full_page:
+            prepared = self.speculator.take_scroll(self, delta_x, delta_y)
+
         p.mouse.wheel(delta_x, delta_y)
+
+        if self.speculator is not None:
+            hit = (
+                prepared is not None
+                and self._wait_for_scroll(prepared.target_scroll)
+                and self.speculator.matches(self, prepared)
+            )
+            self.speculator.record_scroll(hit if prepared is not None else None, (delta_x, delta_y))
+            if hit:
+                self._save_products()
+                self.speculator.on_action(self)
+                return prepared.path
+
         self.wait_until_stable()
         return self.screenshot(screenshot_path, full_page=full_page)
 
@@ -242,6 +292,89 @@ class WebAgent:
         self.wait_until_stable()
         return self.screenshot(screenshot_path, full_page=full_page)
 
+    def batch_actions_and_screenshot(
+            self,
+            actions: list[dict[str, Any]],
+            screenshot_path: Optional[str | os.PathLike] = None,
+            full_page: bool = False,
+            invert_scroll: bool = False,
+    ) -> tuple[list[dict[str, Any]], Path]:
+        """Выполняет последовательность действий и делает один скриншот в конце.
+
+        Каждое действие — словарь с ключом 'type':
+          - click: x, y, button='left', click_count=1
+          - type: text, press_enter=True, clear_before=True, typing_delay_ms=10 (как в fill_and_screenshot у type_text)
+          - scroll: delta_x=0, delta_y=800 (при invert_scroll — знак как у инструмента scroll, delta_y=1000)
+          - wait: ms=1000
+          - key: key (например 'Enter', 'Escape')
+
+        Между действиями выполняются только короткие проверки стабильности:
+        после клика, нажатия Enter и скролла, так как они могут менять DOM.
+        Некорректное действие (не словарь, нечисловые координаты) считается ошибкой этого действия.
+        При первой ошибке выполнение прерывается, оставшиеся действия помечаются как 'skipped'.
+        Возвращает список статусов по каждому действию и путь к скриншоту.
+        """
+        p = self.page
+        results: list[dict[str, Any]] = []
+        failed = False
+
+        for index, action in enumerate(actions):
+            action_type = action.get("type") if isinstance(action, dict) else None
+            if failed:
+                results.append({"index": index, "type": action_type, "status": "skipped"})
+                continue
+
+            try:
+                if not isinstance(action, dict):
+                    raise ValueError(f"Action must be an object, got {type(action).__name__}")
+                if action_type == "click":
+                    p.mouse.click(
+                        int(action["x"]),
+                        int(action["y"]),
+                        button=action.get("button", "left"),
+                        click_count=int(action.get("click_count", 1)),
+                    )
+                    self.last_pointer = (int(action["x"]), int(action["y"]))
+                    self.wait_until_stable(max_wait_ms=300, dom_quiet_ms=150)
+                elif action_type == "type":
+                    if action.get("clear_before", True):
+                        p.keyboard.press("Control+A")
+                        p.keyboard.press("Delete")
+                    text = action.get("text", "")
+                    if text:
+                        p.keyboard.type(str(text), delay=max(0, int(action.get("typing_delay_ms", 10))))
+                    if action.get("press_enter", True):
+                        p.keyboard.press("Enter")
+                        self.wait_until_stable(max_wait_ms=300, dom_quiet_ms=150)
+                elif action_type == "scroll":
+                    delta_x = int(action.get("delta_x", 0))
+                    delta_y = int(action.get("delta_y", 1000 if invert_scroll else 800))
+                    if invert_scroll:
+                        delta_x, delta_y = -delta_x, -delta_y
+                    p.mouse.wheel(delta_x, delta_y)
+                    self.wait_until_stable(max_wait_ms=200, dom_quiet_ms=100)
+                elif action_type == "wait":
+                    p.wait_for_timeout(int(action.get("ms", 1000)))
+                elif action_type == "key":
+                    p.keyboard.press(str(action["key"]))
+                    self.wait_until_stable(max_wait_ms=300, dom_quiet_ms=150)
+                else:
+                    raise ValueError(f"Unknown action type: {action_type!r}")
+            except Exception as e:
+                failed = True
+                results.append({"index": index, "type": action_type, "status": "error", "error": str(e)})
+                continue
+
+            results.append({"index": index, "type": action_type, "status": "ok"})
+
+        # Полная стабилизация — только один раз, перед итоговым скриншотом
+        self.wait_until_stable()
+        return results, self.screenshot(screenshot_path, full_page=full_page)
+
+    def new_isolated_context(self) -> BrowserContext:
+        """Новый контекст в текущем браузере с теми же настройками, но без cookies, истории и кэша агента."""
+        return self._browser.new_context(**self._context_args)
+
     def get_current_url(self) -> str:
         """Возвращает текущий URL страницы."""
         return self.page.url
@@ -289,14 +422,117 @@ class WebAgent:
         )
 
         self.wait_until_stable()
-        path = self.screenshot(screenshot_path, full_page=False)
+        # Перезапуск сбросил бы трансформацию body — запрещаем его на этом снимке
+        path = self.screenshot(screenshot_path, full_page=False, allow_recycle=False)
 
         # Восстанавливаем нормальный масштаб
         p.evaluate("""() => { document.body.style.transform = 'none'; }""")
         return path
 
+    def sample_resources(self) -> dict[str, Any]:
+        """Снимает показатели ресурсов браузера.
+
+        - js_heap_used_mb / js_heap_total_mb / dom_nodes / documents — CDP Performance.getMetrics текущей страницы
+        - pages — число открытых страниц во всех контекстах
+        - browser_pss_mb — суммарный PSS процессов Chromium (None, если недоступно)
+        """
+        reading: dict[str, Any] = {
+            "pages": sum(len(ctx.pages) for ctx in self._browser.contexts) if self._browser else 0,
+        }
+
+        cdp = self.page.context.new_cdp_session(self.page)
+        try:
+            cdp.send("Performance.enable")
+            perf = {m["name"]: m["value"] for m in cdp.send("Performance.getMetrics").get("metrics", [])}
+        finally:
+            try:
+                cdp.detach()
+            except Exception:
+                pass
+        reading["js_heap_used_mb"] = perf.get("JSHeapUsedSize", 0) / 2 ** 20
+        reading["js_heap_total_mb"] = perf.get("JSHeapTotalSize", 0) / 2 ** 20
+        reading["dom_nodes"] = int(perf.get("Nodes", 0))
+        reading["documents"] = int(perf.get("Documents", 0))
+
+        reading["browser_pss_mb"] = None
+        try:
+            browser_cdp = self._browser.new_browser_cdp_session()
+            try:
+                processes = browser_cdp.send("SystemInfo.getProcessInfo").get("processInfo", [])
+            finally:
+                browser_cdp.detach()
+            pss = [read_process_pss_mb(int(proc["id"])) for proc in processes]
+            pss = [m for m in pss if m is not None]
+            if pss:
+                reading["browser_pss_mb"] = sum(pss)
+        except Exception:
+            pass
+
+        return reading
+
+    def recycle(self, level: Literal["context", "browser"] = "context") -> bool:
+        """Пересоздаёт контекст (или весь браузер) и открывает текущий URL с прежней позицией прокрутки.
+
+        Cookies и localStorage (регион, закрытые баннеры, согласия) переносятся в новый контекст.
+        Старые контекст/браузер закрываются только после того, как созданы новые: если создать их
+        не удалось, исключение пробрасывается, а агент остаётся на прежней странице.
+        Если текущий URL открыть не удалось, открывается стартовый self.url и возвращается False.
+        """
+        url = self.page.url or self.url
+        try:
+            scroll = self.page.evaluate("() => [window.scrollX, window.scrollY]")
+        except Exception:
+            scroll = [0, 0]
+        try:
+            storage_state = self._context.storage_state()
+        except Exception:
+            storage_state = None
+
+        old_browser, old_context = self._browser, self._context
+        browser = self._pw.chromium.launch(**self._launch_args) if level == "browser" else old_browser
+        try:
+            context, page = self._new_context(browser, storage_state=storage_state)
+        except Exception:
+            if browser is not old_browser:
+                try:
+                    browser.close()
+                except Exception:
+                    pass
+            raise
+
+        try:
+            old_context.close()
+        except Exception:
+            pass
+        if browser is not old_browser:
+            try:
+                old_browser.close()
+            except Exception:
+                pass
+        self._browser, self._context, self._page = browser, context, page
+
+        try:
+            page.goto(url, wait_until="load")
+            self.wait_until_stable(max_wait_ms=1000)
+        except Exception:
+            try:
+                page.goto(self.url, wait_until="load")
+                self.wait_until_stable(max_wait_ms=1000)
+            except Exception:
+                pass
+            return False
+
+        try:
+            self.page.evaluate("([x, y]) => window.scrollTo(x, y)", scroll)
+            self.wait_until_stable()
+        except Exception:
+            pass
+        return True
+
     def close(self) -> None:
         """Закрыть страницу/контекст/браузер и Playwright."""
+        if self.speculator is not None:
+            self.speculator.close()
         try:
             if self._page:
                 self._page.close()
@@ -322,6 +558,45 @@ class WebAgent:
             self._context = None
             self._browser = None
 
+    def _save_products(self) -> None:
+        """Пишет товары текущей страницы в кэш товаров. Ошибки извлечения не прерывают действие агента."""
+        if self.product_store is None:
+            return
+        try:
+            save_page_products(self.page, self.product_store)
+        except Exception:
+            pass
+
+    def _wait_for_scroll(self, target: tuple[int, int], timeout_ms: int = 500) -> bool:
+        """Ждёт, пока прокрутка окна (в том числе плавная) дойдёт до target. True, если дошла."""
+        try:
+            self.page.wait_for_function(
+                "([x, y]) => Math.round(window.scrollX) === x && Math.round(window.scrollY) === y",
+                arg=list(target),
+                timeout=timeout_ms,
+            )
+            return True
+        except PWTimeoutError:
+            return False
+
+    def _new_context(self, browser: Browser, storage_state: Optional[dict] = None) -> tuple[BrowserContext, Page]:
+        """Создаёт в browser контекст (опционально с сохранённым storage_state) и страницу в нём."""
+        context_args = dict(self._context_args)
+        if storage_state is not None:
+            context_args["storage_state"] = storage_state
+        context = browser.new_context(**context_args)
+        try:
+            return context, context.new_page()
+        except Exception:
+            context.close()
+            raise
+
+    def _open_context(self, url: str) -> None:
+        """Создаёт контекст и страницу в текущем браузере и открывает url."""
+        self._context, self._page = self._new_context(self._browser)
+        self._page.goto(url, wait_until="load")
+        self.wait_until_stable(max_wait_ms=1000)
+
     def _wait_for_dom_quiet(self, quiet_ms: int = 800, timeout_ms: int = 10000) -> None:
         """Ожидание «тишины» DOM — отсутствия мутаций в течение quiet_ms подряд.
 
@@ -376,6 +651,9 @@ def get_agent(
     viewport: Optional[tuple[int, int]] = (1000, 1000),
     user_agent: Optional[str] = None,
     screenshot_path: Path = Path("web-tools/screenshots"),
+    watchdog: Optional[ResourceWatchdog] = None,
+    speculator: Optional[Speculator] = None,
+    product_store: Optional[ProductStore] = None,
 ) -> WebAgent:
     """Возвращает единый экземпляр агента (создаётся при первом вызове).
 
@@ -391,6 +669,9 @@ def get_agent(
             viewport=viewport,
             user_agent=user_agent,
             screenshot_path=screenshot_path,
+            watchdog=watchdog,
+            speculator=speculator,
+            product_store=product_store,
         )
     return _agent_singleton
 